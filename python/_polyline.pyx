@@ -0,0 +1,240 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+""" Cython implementation of the google polyline decoder and encoder.
+
+Build in place with:
+    cythonize -i _polyline.pyx
+
+google_api falls back to its pure Python version when this is not built.
+"""
+from cpython.float cimport PyFloat_FromDouble
+from cpython.bytes cimport PyBytes_FromStringAndSize
+from cpython.mem cimport PyMem_Malloc, PyMem_Free
+from libc.stdint cimport int64_t, uint64_t
+
+import numpy as np
+
+
+cdef extern from *:
+    """
+    #include <string.h>
+
+    /* Loads 8 bytes with the first one in the lowest bits */
+    static inline uint64_t _polyline_load_le64(const unsigned char* p) {
+        uint64_t w;
+        memcpy(&w, p, 8);
+    #if defined(__BYTE_ORDER__) && __BYTE_ORDER__ == __ORDER_BIG_ENDIAN__
+        w = __builtin_bswap64(w);
+    #endif
+        return w;
+    }
+
+    /* Index of the lowest set bit, x must not be 0 */
+    static inline int _polyline_ctz64(uint64_t x) {
+    #if defined(__GNUC__) || defined(__clang__)
+        return __builtin_ctzll(x);
+    #else
+        int n = 0;
+        while (!(x & 1)) { x >>= 1; n++; }
+        return n;
+    #endif
+    }
+    """
+    uint64_t _polyline_load_le64(const unsigned char* p) nogil
+    int _polyline_ctz64(uint64_t x) nogil
+
+
+cdef inline uint64_t _low_bytes(uint64_t w, int nbytes) noexcept nogil:
+    # Keeps the nbytes lowest bytes of w, nbytes must be < 8
+    return w & ((1ULL << (8 * nbytes)) - 1)
+
+
+cdef inline int64_t _unpack(uint64_t w) noexcept nogil:
+    # Joins the 5 bit chunks held in the bytes of w into a single value:
+    # pairs of bytes, then pairs of 16 bit lanes, then the two 32 bit halves
+    cdef uint64_t x = w & 0x1F1F1F1F1F1F1F1FULL
+    x = (x & 0x001F001F001F001FULL) | ((x & 0x1F001F001F001F00ULL) >> 3)
+    x = (x & 0x000003FF000003FFULL) | ((x & 0x03FF000003FF0000ULL) >> 6)
+    x = (x & 0xFFFFFULL) | ((x >> 12) & 0xFFFFF00000ULL)
+    return <int64_t>((x >> 1) ^ -(x & 1))
+
+
+cdef inline Py_ssize_t _read_varint(const unsigned char* p, Py_ssize_t index,
+                                    Py_ssize_t n, int64_t* value) noexcept nogil:
+    # Decodes the value starting at p[index] byte by byte and returns the
+    # index after it, or -1 if the polyline is truncated
+    cdef int64_t result = 0
+    cdef int shift = 0, byte
+
+    while True:
+        if index >= n:
+            return -1
+        byte = p[index] - 63
+        index += 1
+        result |= <int64_t>(byte & 0x1f) << shift
+        shift += 5
+        if byte < 0x20:
+            break
+    value[0] = (result >> 1) ^ -(result & 1)
+    return index
+
+
+cdef Py_ssize_t _decode_deltas(const unsigned char* p, Py_ssize_t n,
+                               int64_t* deltas) noexcept nogil:
+    # Writes the lat/lng change of each point in deltas and returns the
+    # number of points, or -1 if the polyline is truncated
+    cdef Py_ssize_t index = 0, k = 0
+    cdef uint64_t w, stop, second
+    cdef int lat_bytes, point_bytes
+
+    while index < n:
+        if index + 8 <= n:
+            # All the chunk bytes are >= 63, so this subtracts 63 from each
+            # byte without borrowing into the next one
+            w = _polyline_load_le64(p + index) - 0x3F3F3F3F3F3F3F3FULL
+            # A chunk without the 0x20 bit is the last one of its value
+            stop = ~w & 0x2020202020202020ULL
+            second = stop & (stop - 1)
+            if second:
+                # Both values of the point are in these 8 bytes
+                lat_bytes = _polyline_ctz64(stop) // 8 + 1
+                point_bytes = _polyline_ctz64(second) // 8 + 1
+                deltas[2 * k] = _unpack(_low_bytes(w, lat_bytes))
+                w >>= 8 * lat_bytes
+                if point_bytes < 8:
+                    w = _low_bytes(w, point_bytes - lat_bytes)
+                deltas[2 * k + 1] = _unpack(w)
+                index += point_bytes
+                k += 1
+                continue
+
+        # Near the end of the buffer, or points longer than 8 bytes
+        index = _read_varint(p, index, n, &deltas[2 * k])
+        if index < 0:
+            return -1
+        index = _read_varint(p, index, n, &deltas[2 * k + 1])
+        if index < 0:
+            return -1
+        k += 1
+
+    return k
+
+
+cdef object _decode_one(object polyline_str, object scratch, bint to_array,
+                        bint to_tuples):
+    cdef bytes data = polyline_str.encode('ascii') if isinstance(polyline_str, str) else polyline_str
+    cdef const unsigned char* p = data
+    cdef Py_ssize_t n = len(data)
+    cdef int64_t[:, ::1] deltas = scratch
+    cdef Py_ssize_t i, k
+    cdef int64_t lat = 0, lng = 0
+    cdef list coordinates
+
+    # The scan does not touch Python objects, so other threads can run
+    with nogil:
+        k = _decode_deltas(p, n, &deltas[0, 0])
+    if k < 0:
+        raise IndexError('truncated polyline')
+
+    if to_array:
+        return np.cumsum(scratch[:k], axis=0) / 100000.0
+
+    # The number of points is known after the scan, so size the list once
+    coordinates = [None] * k
+    for i in range(k):
+        lat += deltas[i, 0]
+        lng += deltas[i, 1]
+        if to_tuples:
+            coordinates[i] = (PyFloat_FromDouble(lat / 100000.0),
+                              PyFloat_FromDouble(lng / 100000.0))
+        else:
+            coordinates[i] = [PyFloat_FromDouble(lat / 100000.0),
+                              PyFloat_FromDouble(lng / 100000.0)]
+
+    return coordinates
+
+
+cdef object _scratch(Py_ssize_t n):
+    # Every coordinate takes at least two bytes
+    return np.empty((n // 2 + 1, 2), dtype=np.int64)
+
+
+def decode_polyline(polyline_str, as_array=False, as_tuples=False):
+    """ Decodes a google polyline into a list of coordinates
+
+    :param polyline_str: A google polyline
+    :type polyline_str: string or bytes
+    :param as_array: Return a numpy array of shape (N, 2) instead of a list
+    :type as_array: bool
+    :param as_tuples: Return each coordinate as a (lat, lon) tuple
+    :type as_tuples: bool
+
+    :rtype: list of coordinates in format [lat, lon]
+    """
+    return _decode_one(polyline_str, _scratch(len(polyline_str)), as_array, as_tuples)
+
+
+def decode_polylines(polylines, as_array=False, as_tuples=False):
+    """ Decodes many google polylines, sharing one work buffer between them
+
+    :param polylines: google polylines
+    :type polylines: list of strings or bytes
+    :param as_array: Return numpy arrays of shape (N, 2) instead of lists
+    :type as_array: bool
+    :param as_tuples: Return each coordinate as a (lat, lon) tuple
+    :type as_tuples: bool
+
+    :rtype: list with the coordinates of each polyline
+    """
+    cdef list items = polylines if isinstance(polylines, list) else list(polylines)
+    if not items:
+        return []
+    scratch = _scratch(max(map(len, items)))
+    return [_decode_one(polyline_str, scratch, as_array, as_tuples)
+            for polyline_str in items]
+
+
+# A 64 bit value takes at most 13 chunks of 5 bits
+cdef enum:
+    MAX_CHUNKS = 13
+
+
+cdef inline Py_ssize_t _emit(char* buffer, long value):
+    cdef unsigned long v = ~(<unsigned long>value << 1) if value < 0 else (<unsigned long>value << 1)
+    cdef Py_ssize_t pos = 0
+    while v >= 32:
+        buffer[pos] = <char>(((v & 31) | 0x20) + 63)
+        v >>= 5
+        pos += 1
+    buffer[pos] = <char>(v + 63)
+    return pos + 1
+
+
+def encode_coords(coords):
+    """ Encodes a polyline using Google's polyline algorithm
+
+    :param coords: Coordinates to transform (list of tuples in order: latitude,
+    longitude).
+    :type coords: list
+    :returns: Google-encoded polyline string.
+    :rtype: string
+    """
+    cdef list points = coords if isinstance(coords, list) else list(coords)
+    cdef Py_ssize_t n = len(points)
+    cdef Py_ssize_t pos = 0
+    cdef long lat, lng, prev_lat = 0, prev_lng = 0
+    cdef char* buffer = <char*>PyMem_Malloc(2 * MAX_CHUNKS * n + 1)
+    if buffer == NULL:
+        raise MemoryError()
+
+    try:
+        for x, y in points:
+            lat, lng = <long>(y * 1e5), <long>(x * 1e5)
+
+            pos += _emit(buffer + pos, lng - prev_lng)
+            pos += _emit(buffer + pos, lat - prev_lat)
+
+            prev_lat, prev_lng = lat, lng
+
+        return PyBytes_FromStringAndSize(buffer, pos).decode('ascii')
+    finally:
+        PyMem_Free(buffer)
@@ -1,52 +1,79 @@
+from functools import lru_cache
+
+import numpy as np
+
+
 def get_geocode_locations(geocode_result):
-    locations = []
-    for address in geocode_result:
-        location = address['geometry']['location']
-        locations.append([location['lat'], location['lng']])
-    return locations
+    return [[location['lat'], location['lng']]
+            for address in geocode_result
+            for location in (address['geometry']['location'],)]
 
 
-def get_duration_matrix(distance_matrix_result):
+def get_duration_matrix(distance_matrix_result, as_array=False):
     """ Returns the durations matrix of a google response.
     :param distance_matrix_result: Is the response of gmaps.distance_matrix()
     :type distance_matrix_result: a dictionary, with a list of rows and elements
+    :param as_array: Return a pair of numpy arrays instead, the int32 values
+    and a boolean mask of the cells that are OK
+    :type as_array: bool
     
-    :rtype: matrix of durations, list of lists.
+    :rtype: matrix of durations, list of lists, or (values, mask) with as_array
     """
-    if 'rows' not in distance_matrix_result: return []
-    M = len(distance_matrix_result['rows'])
-    if M == 0: return []
-    N = len(distance_matrix_result['rows'][0]['elements'])
-    matrix = [[None for j in range(N)] for i in range(M)]
-    for i, row in enumerate(distance_matrix_result['rows']):
+    rows = distance_matrix_result.get('rows', [])
+    M = len(rows)
+    N = len(rows[0]['elements']) if M > 0 else 0
+    if as_array:
+        matrix = np.zeros((M, N), dtype=np.int32)
+        mask = np.zeros((M, N), dtype=bool)
+    elif M == 0:
+        return []
+    else:
+        matrix = [[None for j in range(N)] for i in range(M)]
+    for i, row in enumerate(rows):
         elements = row['elements']
         for j, element in enumerate(elements):
             if element['status'] == 'OK':
+                if as_array:
+                    mask[i][j] = True
                 #if traffic time was calculated, return this time
-                if 'duration_in_traffic' in element.keys():
-                    matrix[i][j] = element['duration_in_traffic']['value']
-                else:
-                    matrix[i][j] = element['duration']['value']
+                duration = element.get('duration_in_traffic')
+                if duration is None:
+                    duration = element['duration']
+                matrix[i][j] = duration['value']
+    if as_array:
+        return matrix, mask
     return matrix
 
 
-def get_distance_matrix(distance_matrix_result):
+def get_distance_matrix(distance_matrix_result, as_array=False):
     """ Returns the distance matrix of a google response.
     :param distance_matrix_result: Is the response of gmaps.distance_matrix()
     :type distance_matrix_result: a dictionary, with a list of rows and elements
+    :param as_array: Return a pair of numpy arrays instead, the int32 values
+    and a boolean mask of the cells that are OK
+    :type as_array: bool
     
-    :rtype: matrix of distances, list of lists.
+    :rtype: matrix of distances, list of lists, or (values, mask) with as_array
     """
-    if 'rows' not in distance_matrix_result: return []
-    M = len(distance_matrix_result['rows'])
-    if M == 0: return []
-    N = len(distance_matrix_result['rows'][0]['elements'])
-    matrix = [[None for j in range(N)] for i in range(M)]
-    for i, row in enumerate(distance_matrix_result['rows']):
+    rows = distance_matrix_result.get('rows', [])
+    M = len(rows)
+    N = len(rows[0]['elements']) if M > 0 else 0
+    if as_array:
+        matrix = np.zeros((M, N), dtype=np.int32)
+        mask = np.zeros((M, N), dtype=bool)
+    elif M == 0:
+        return []
+    else:
+        matrix = [[None for j in range(N)] for i in range(M)]
+    for i, row in enumerate(rows):
         elements = row['elements']
         for j, element in enumerate(elements):
             if element['status'] == 'OK':
+                if as_array:
+                    mask[i][j] = True
                 matrix[i][j] = element['distance']['value']
+    if as_array:
+        return matrix, mask
     return matrix
 
 def get_directions_polylines(directions_result):
@@ -55,16 +82,11 @@ def get_directions_polylines(directions_result):
     :param directions_result: Is the response of gmaps.distance_matrix()
     :type directions_result: a list of directions dictionaries
     
-    :rtype: list of Google-encoded polyline strings.
+    :rtype: list of Google-encoded polyline strings, None for the directions
+    without one.
     """
-    polylines = []
-    if len(directions_result) > 0:
-        for direction in directions_result:
-            if 'overview_polyline' in direction:
-                polylines.append(direction['overview_polyline']['points'])
-            else:
-                polyline.append(None)
-    return polylines
+    return [direction.get('overview_polyline', {}).get('points')
+            for direction in directions_result]
 
 def get_directions_total_distance(directions_result):
     """ Returns the total distance (in meters) of all the directions
@@ -74,9 +96,8 @@ def get_directions_total_distance(directions_result):
     
     :rtype: list of integers with the total distance in meters
     """
-    distances = get_directions_legs_distance(directions_result)
-    
-    return list(map(lambda x: sum(x), distances))
+    return [sum(leg['distance']['value'] for leg in direction['legs'])
+            for direction in directions_result if 'legs' in direction]
 
 def get_directions_legs_distance(directions_result):
     """ Returns the distance between each waypoint in the direction
@@ -104,9 +125,9 @@ def get_directions_total_duration(directions_result):
     
     :rtype: list of integers with the total duration in seconds
     """
-    durations = get_directions_legs_duration(directions_result)
-    
-    return list(map(lambda x: sum(x), durations))
+    return [sum((leg.get('duration_in_traffic') or leg['duration'])['value']
+                for leg in direction['legs'])
+            for direction in directions_result if 'legs' in direction]
 
 def get_directions_legs_duration(directions_result):
     """ Returns the total duration (in seconds) of all the directions
@@ -121,13 +142,37 @@ def get_directions_legs_duration(directions_result):
         if 'legs' in direction:
             distance = []
             for leg in direction['legs']:
-                if 'duration_in_traffic' in leg:
-                    distance.append(leg['duration_in_traffic']['value'])
-                else:
-                    distance.append(leg['duration']['value'])
+                duration = leg.get('duration_in_traffic') or leg['duration']
+                distance.append(duration['value'])
             distances.append(distance)
     return distances
 
+def get_directions_summary(directions_result):
+    """ Returns the distance and duration of each waypoint, and their totals,
+    walking the directions only once
+
+    :param directions_result: Is the response of gmaps.directions()
+    :type directions_result: a list of directions dictionaries
+    
+    :rtype: dictionary with the lists 'legs_distance', 'legs_duration',
+    'total_distance' and 'total_duration', same as the get_directions_* functions
+    """
+    legs_distance, legs_duration = [], []
+    for direction in directions_result:
+        if 'legs' in direction:
+            distance, duration = [], []
+            for leg in direction['legs']:
+                distance.append(leg['distance']['value'])
+                duration.append((leg.get('duration_in_traffic') or leg['duration'])['value'])
+            legs_distance.append(distance)
+            legs_duration.append(duration)
+    return {
+        'legs_distance': legs_distance,
+        'legs_duration': legs_duration,
+        'total_distance': list(map(sum, legs_distance)),
+        'total_duration': list(map(sum, legs_duration)),
+    }
+
 def waypoints_via(waypoints):
     """ Returns the waypoints with the via parameter added
     This influences the route but avoid stopovers
@@ -137,49 +182,119 @@ def waypoints_via(waypoints):
     
     :rtype: a string of waypoints in via format
     """   
-    return '|'.join([f'via:{lat},{lon}' for (lat,lon) in waypoints])
+    return '|'.join(f'via:{lat},{lon}' for (lat,lon) in waypoints)
         
 
-def decode_polyline(polyline_str):
+def decode_polyline(polyline_str, as_array=False, as_tuples=False):
     """ Decodes a google polyline into a list of coordinates
     Reference:
     https://stackoverflow.com/questions/15380712/how-to-decode-polylines-from-google-maps-direction-api-in-php
     :param polyline_str: A google polyline
-    :type polyline_str: string
+    :type polyline_str: string or bytes
+    :param as_array: Return a numpy array of shape (N, 2) instead of a list
+    :type as_array: bool
+    :param as_tuples: Return each coordinate as a (lat, lon) tuple, which
+    takes less memory than a list
+    :type as_tuples: bool
     
     :rtype: list of coordinates in format [lat, lon]
     """
+    # Indexing bytes gives ints directly, no ord() or 1-char strings
+    data = polyline_str.encode('ascii') if isinstance(polyline_str, str) else polyline_str
+    n = len(data)
     index, lat, lng = 0, 0, 0
-    coordinates = []
-    changes = {'latitude': 0, 'longitude': 0}
+    # Every coordinate takes at least two bytes, reserve room for all of them
+    coordinates = [None] * (0 if as_array else n // 2 + 1)
+    k = 0
+    deltas = []
 
     # Coordinates have variable length when encoded, so just keep
     # track of whether we've hit the end of the string. In each
     # while loop iteration, a single coordinate is decoded.
-    while index < len(polyline_str):
-        # Gather lat/lon changes, store them in a dictionary to apply them later
-        for unit in ['latitude', 'longitude']:
-            shift, result = 0, 0
+    while index < n:
+        # Latitude change
+        shift, result = 0, 0
+        while True:
+            byte = data[index] - 63
+            index += 1
+            result |= (byte & 0x1f) << shift
+            shift += 5
+            if not byte >= 0x20:
+                break
+        # Zig-zag decoding without branching on the sign bit
+        dlat = (result >> 1) ^ -(result & 1)
+
+        # Longitude change
+        shift, result = 0, 0
+        while True:
+            byte = data[index] - 63
+            index += 1
+            result |= (byte & 0x1f) << shift
+            shift += 5
+            if not byte >= 0x20:
+                break
+        dlng = (result >> 1) ^ -(result & 1)
+
+        if as_array:
+            # Positions are accumulated all at once with numpy below
+            deltas.append((dlat, dlng))
+            continue
+
+        lat += dlat
+        lng += dlng
+
+        if as_tuples:
+            coordinates[k] = (lat / 100000.0, lng / 100000.0)
+        else:
+            coordinates[k] = [lat / 100000.0, lng / 100000.0]
+        k += 1
+
+    if as_array:
+        deltas = np.array(deltas, dtype=np.int64).reshape(-1, 2)
+        return np.cumsum(deltas, axis=0) / 100000.0
+
+    del coordinates[k:]
+    return coordinates
 
-            while True:
-                byte = ord(polyline_str[index]) - 63
-                index += 1
-                result |= (byte & 0x1f) << shift
-                shift += 5
-                if not byte >= 0x20:
-                    break
 
-            if (result & 1):
-                changes[unit] = ~(result >> 1)
-            else:
-                changes[unit] = (result >> 1)
+def decode_polylines(polylines, as_array=False, as_tuples=False):
+    """ Decodes many google polylines
 
-        lat += changes['latitude']
-        lng += changes['longitude']
+    :param polylines: google polylines
+    :type polylines: list of strings or bytes
+    :param as_array: Return numpy arrays of shape (N, 2) instead of lists
+    :type as_array: bool
+    :param as_tuples: Return each coordinate as a (lat, lon) tuple
+    :type as_tuples: bool
+    
+    :rtype: list with the coordinates of each polyline
+    """
+    return [decode_polyline(polyline_str, as_array, as_tuples) for polyline_str in polylines]
 
-        coordinates.append([lat / 100000.0, lng / 100000.0])
 
-    return coordinates
+# Longer polylines are not cached, to bound the memory used by the cache
+_CACHED_POLYLINE_MAX_LENGTH = 20000
+
+
+@lru_cache(maxsize=4096)
+def _decode_polyline_cached(polyline_str):
+    return tuple(decode_polyline(polyline_str, as_tuples=True))
+
+
+def decode_polyline_cached(polyline_str):
+    """ Decodes a google polyline, reusing the result for repeated polylines
+
+    The coordinates are shared between calls, so they are returned as
+    tuples that can't be modified.
+
+    :param polyline_str: A google polyline
+    :type polyline_str: string or bytes
+    
+    :rtype: tuple of coordinates in format (lat, lon)
+    """
+    if len(polyline_str) > _CACHED_POLYLINE_MAX_LENGTH:
+        return tuple(decode_polyline(polyline_str, as_tuples=True))
+    return _decode_polyline_cached(polyline_str)
 
 
 def encode_coords(coords):
@@ -195,7 +310,7 @@ def encode_coords(coords):
     :rtype: string
     '''
 
-    result = []
+    result = bytearray()
 
     prev_lat = 0
     prev_lng = 0
@@ -203,37 +318,66 @@ def encode_coords(coords):
     for x, y in coords:
         lat, lng = int(y * 1e5), int(x * 1e5)
 
-        d_lat = _encode_value(lat - prev_lat)
-        d_lng = _encode_value(lng - prev_lng)
+        _append_encoded(result, lng - prev_lng)
+        _append_encoded(result, lat - prev_lat)
 
         prev_lat, prev_lng = lat, lng
 
-        result.append(d_lng)
-        result.append(d_lat)
+    return result.decode('ascii')
+
+
+def encode_coords_array(coords):
+    '''Encodes a polyline from a numpy array of coordinates
+
+    Same output as encode_coords, but the conversion to integers and the
+    deltas between points are computed with numpy.
 
-    return ''.join(c for r in result for c in r)
+    :param coords: Coordinates to transform, array of shape (N, 2) with the
+    same column order as the tuples of encode_coords.
+    :type coords: numpy.ndarray
+    :returns: Google-encoded polyline string.
+    :rtype: string
+    '''
+    ints = (np.asarray(coords, dtype=np.float64) * 1e5).astype(np.int64)
+    deltas = np.diff(ints, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+
+    result = bytearray()
+    for value in deltas.ravel().tolist():
+        _append_encoded(result, value)
+
+    return result.decode('ascii')
 
 
-def _split_into_chunks(value):
+def _encode_chunks(value):
+    # Step 5 - 10
+    encoded = bytearray()
     while value >= 32:  # 2^5, while there are at least 5 bits
 
         # first & with 2^5-1, zeros out all the bits other than the first five
         # then OR with 0x20 if another bit chunk follows
-        yield (value & 31) | 0x20
+        encoded.append(((value & 31) | 0x20) + 63)
         value >>= 5
-    yield value
+    encoded.append(value + 63)
+    return bytes(encoded)
 
 
-def _encode_value(value):
-    # Step 2 & 4
-    value = ~(value << 1) if value < 0 else (value << 1)
-
-    # Step 5 - 8
-    chunks = _split_into_chunks(value)
+# Encoded bytes of every value that fits in two chunks, which covers
+# most of the deltas between consecutive points of a route
+_ENCODED_TABLE = [_encode_chunks(value) for value in range(1024)]
 
-    # Step 9-10
-    return (chr(chunk + 63) for chunk in chunks)
 
+def _append_encoded(buffer, value):
+    # Step 2 & 4
+    value = ~(value << 1) if value < 0 else (value << 1)
 
+    if value < 1024:
+        buffer += _ENCODED_TABLE[value]
+    else:
+        buffer += _encode_chunks(value)
 
 
+try:
+    # Cython versions of the polyline codec, built with `cythonize -i _polyline.pyx`
+    from _polyline import decode_polyline, decode_polylines, encode_coords
+except ImportError:
+    pass